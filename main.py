@@ -1,17 +1,34 @@
 import os
 import io
+import heapq
+import logging
+import asyncio
 import secrets
-from datetime import datetime, timedelta
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import asynccontextmanager
+from urllib.parse import quote
+from zipfile import BadZipFile
 
 from fastapi import FastAPI, UploadFile, File, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 
+import anyio
+import msgpack
+import orjson
+from lxml import etree
 from pptx import Presentation
 from pptx.util import Inches
 from pptx.dml.color import RGBColor
+from pptx.exc import PackageNotFoundError
 from pptx.enum.shapes import PP_PLACEHOLDER_TYPE
 from PIL import Image
+from redis.asyncio import Redis
 
 # =========================
 # Assets (solo logo)
@@ -32,6 +49,31 @@ if not os.path.exists(DEFAULT_LOGO_PATH):
         pass
     img.save(DEFAULT_LOGO_PATH, format="PNG")
 
+# El logo se prepara una sola vez: se reduce al tamaño máximo en que se dibuja
+# (5" a ~96 dpi) y se guarda como PNG optimizado. Así cada copia embebida pesa
+# menos y add_picture recibe un stream nuevo en cada uso. pillow-simd sirve
+# como reemplazo directo de pillow para acelerar el resample.
+LOGO_MAX_PX = 512
+
+with Image.open(DEFAULT_LOGO_PATH) as logo_img:
+    logo_img.thumbnail((LOGO_MAX_PX, LOGO_MAX_PX), Image.LANCZOS)
+    logo_buf = io.BytesIO()
+    logo_img.save(logo_buf, format="PNG", optimize=True)
+    LOGO_W_PX, LOGO_H_PX = logo_img.size
+LOGO_BYTES = logo_buf.getvalue()
+
+
+def _logo_stream():
+    return io.BytesIO(LOGO_BYTES)
+
+
+def _logo_height(width):
+    # Alto proporcional al ancho, igual que el escalado de add_picture; conocerlo
+    # de antemano permite insertar el logo ya en su posición final
+    return int(round(width * LOGO_H_PX / LOGO_W_PX))
+
+logger = logging.getLogger("formateador")
+
 # =========================
 # Configuración de formateo
 # =========================
@@ -44,7 +86,72 @@ EMU_PER_INCH = 914400
 # =========================
 # FastAPI
 # =========================
-app = FastAPI(title="Formateador de Presentaciones PPTX")
+# Producción:
+#   uvicorn main:app --host 0.0.0.0 --port $PORT --loop uvloop --http httptools
+# uvloop y httptools (requirements.txt) reemplazan el event loop y el parser
+# HTTP en Python puro; uvicorn los elige solo si están instalados. Un único
+# worker salvo que se configure REDIS_URL: sin él cada proceso lleva su propio
+# registro de descargas. El formateo ya reparte carga entre núcleos con el pool.
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    start_pool()
+    try:
+        yield
+    finally:
+        await stop_pool()
+
+
+app = FastAPI(
+    title="Formateador de Presentaciones PPTX",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan,
+)
+
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(50 * 1024 * 1024)))
+UPLOAD_TOO_LARGE = "El archivo supera el tamaño máximo permitido"
+
+
+class UploadLimitMiddleware:
+    # Middleware ASGI puro: solo intercepta POST /procesar/. El resto (health,
+    # descargas) pasa directo, sin el relay por memory stream y task group de
+    # BaseHTTPMiddleware (@app.middleware).
+    def __init__(self, app, max_bytes: int, path: str = "/procesar/"):
+        self.app = app
+        self.max_bytes = max_bytes
+        self.path = path
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] != self.path:
+            await self.app(scope, receive, send)
+            return
+
+        # Con Content-Length se rechaza antes de que FastAPI lea y parsee el cuerpo
+        for name, value in scope["headers"]:
+            if name == b"content-length" and value.isdigit() and int(value) > self.max_bytes:
+                response = ORJSONResponse({"detail": UPLOAD_TOO_LARGE}, status_code=413)
+                await response(scope, receive, send)
+                return
+
+        # Sin Content-Length (chunked) se lleva la cuenta de lo recibido y se
+        # corta apenas supera el tope, antes de que el multipart termine de
+        # volcarse a disco. FastAPI deja pasar la HTTPException al leer el form.
+        received = 0
+
+        async def receive_limited():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    raise HTTPException(status_code=413, detail=UPLOAD_TOO_LARGE)
+            return message
+
+        await self.app(scope, receive_limited, send)
+
+
+# Va registrado antes que CORS para que el 413 también lleve sus cabeceras
+app.add_middleware(UploadLimitMiddleware, max_bytes=MAX_UPLOAD_BYTES)
+
 
 ALLOWED_ORIGINS = [
     "https://www.dipli.ai",
@@ -68,58 +175,269 @@ app.add_middleware(
 # =========================
 # Descargas temporales
 # =========================
-DOWNLOADS: dict[str, tuple[bytes, str, str, datetime]] = {}
 DOWNLOAD_TTL_SECS = 900
+DOWNLOAD_DIR = os.getenv(
+    "DOWNLOAD_DIR", os.path.join(tempfile.gettempdir(), "formateador-descargas")
+)
+# Tope de descargas pendientes en disco (DiskStore): al superarlo se descartan
+# las más próximas a expirar
+MAX_DOWNLOAD_ITEMS = int(os.getenv("MAX_DOWNLOAD_ITEMS", "64"))
+MAX_DOWNLOAD_BYTES = int(os.getenv("MAX_DOWNLOAD_BYTES", str(512 * 1024 * 1024)))
+DOWNLOAD_STREAM_THRESHOLD = 8 * 1024 * 1024  # por encima se envía en chunks
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
 PPTX_MEDIA_TYPE = "application/vnd.openxmlformats-officedocument.presentationml.presentation"
+PPTX_EXT = ".pptx"
+# URL pública del servicio (p. ej. detrás de un proxy fijo). Si está definida,
+# los links de descarga se arman con ella sin reconstruir request.base_url.
+BASE_URL = os.getenv("BASE_URL", "").rstrip("/")
+
+
+class DiskStore:
+    # Registro acotado de descargas del proceso. El resultado se escribe en
+    # DOWNLOAD_DIR y en memoria solo queda la ruta, así el heap de Python no
+    # crece con cada descarga pendiente. Las expiraciones van en un min-heap, así
+    # la limpieza solo toca las entradas vencidas en vez de recorrer todo el
+    # dict. Los vencimientos usan time.monotonic(): un float por entrada e
+    # inmunes a saltos del reloj del sistema.
+    def __init__(self, directory: str, max_items: int, max_bytes: int):
+        self.directory = directory
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.items: dict[str, tuple[str, int, str, str, float]] = {}
+        self.expiry_heap: list[tuple[float, str]] = []
+        os.makedirs(directory, exist_ok=True)
+
+    def _write(self, data: bytes | bytearray) -> str:
+        with tempfile.NamedTemporaryFile(dir=self.directory, suffix=".pptx", delete=False) as f:
+            f.write(data)
+        return f.name
+
+    def _pop_oldest(self) -> int:
+        _, token = heapq.heappop(self.expiry_heap)
+        item = self.items.pop(token, None)
+        if not item:
+            return 0
+        path, size = item[0], item[1]
+        self.total_bytes -= size
+        # Una descarga en curso ya abrió el archivo en get() y sigue leyendo de
+        # su descriptor aunque se borre
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        return size
+
+    def sweep(self, max_age: float):
+        # Archivos huérfanos de un proceso anterior (caída, SIGKILL): su registro
+        # en memoria se perdió con él y nadie más los borraría. Solo se quitan
+        # los ya vencidos, por si otro proceso comparte el directorio.
+        cutoff = time.time() - max_age
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if not entry.name.endswith(PPTX_EXT):
+                    continue
+                try:
+                    if entry.is_file() and entry.stat().st_mtime < cutoff:
+                        os.unlink(entry.path)
+                except FileNotFoundError:
+                    pass
+
+    def cleanup(self):
+        now = time.monotonic()
+        heap = self.expiry_heap
+        while heap and heap[0][0] <= now:
+            self._pop_oldest()
+
+    async def put(self, token: str, data: bytes | bytearray, disposition: str,
+                  media_type: str, ttl: int) -> bool:
+        path = await run_in_threadpool(self._write, data)
+        size = len(data)
+        self.cleanup()
+        # Un token repetido dejaría en el heap una expiración ajena a su entrada
+        if token in self.items:
+            os.unlink(path)
+            return False
+        # Registro lleno (en cantidad o en bytes): se liberan las descargas más
+        # próximas a expirar
+        while self.items and (
+            len(self.items) >= self.max_items
+            or self.total_bytes + size > self.max_bytes
+        ):
+            freed = self._pop_oldest()
+            # Sin el token en el log: es la credencial de la descarga
+            logger.warning("Registro de descargas lleno: se descartó una pendiente (%d bytes)", freed)
+        expires_at = time.monotonic() + ttl
+        self.items[token] = (path, size, disposition, media_type, expires_at)
+        self.total_bytes += size
+        heapq.heappush(self.expiry_heap, (expires_at, token))
+        return True
+
+    async def get(self, token: str):
+        self.cleanup()
+        item = self.items.get(token)
+        if not item:
+            return None
+        path, size, disposition, media_type, _ = item
+        # Se abre acá y no al enviar la respuesta: si la entrada expira o se
+        # descarta mientras tanto, el descriptor abierto sigue sirviendo
+        try:
+            f = await anyio.open_file(path, "rb")
+        except FileNotFoundError:
+            # Se borró entre la consulta y la apertura
+            return None
+        return _iter_file(f), size, disposition, media_type
+
+    async def close(self):
+        while self.expiry_heap:
+            self._pop_oldest()
+
+
+class RedisStore:
+    # Registro compartido entre workers/instancias. Redis expira las claves por
+    # su cuenta (SET ... EX), así que no hace falta limpieza del lado de la app.
+    def __init__(self, url: str):
+        self.client = Redis.from_url(url)
+
+    async def put(self, token: str, data: bytes | bytearray, disposition: str,
+                  media_type: str, ttl: int) -> bool:
+        payload = msgpack.packb((disposition, media_type, data))
+        return bool(await self.client.set(f"dl:{token}", payload, ex=ttl, nx=True))
+
+    async def get(self, token: str):
+        payload = await self.client.get(f"dl:{token}")
+        if payload is None:
+            return None
+        disposition, media_type, data = msgpack.unpackb(payload)
+        return _iter_chunks(data), len(data), disposition, media_type
+
+    async def close(self):
+        await self.client.aclose()
+
+
+# Con REDIS_URL las descargas funcionan con varios workers de uvicorn; sin él,
+# cada proceso lleva su propio registro de archivos en disco.
+REDIS_URL = os.getenv("REDIS_URL")
+if REDIS_URL:
+    DOWNLOADS = RedisStore(REDIS_URL)
+else:
+    DOWNLOADS = DiskStore(DOWNLOAD_DIR, MAX_DOWNLOAD_ITEMS, MAX_DOWNLOAD_BYTES)
+    DOWNLOADS.sweep(DOWNLOAD_TTL_SECS)
+
+
+def _content_disposition(filename: str) -> str:
+    # Se arma una sola vez al registrar, no en cada descarga. Los nombres no
+    # ASCII van en filename* (RFC 6266): Starlette codifica las cabeceras en
+    # latin-1 y fallaría con el nombre original.
+    safe = filename.replace('"', "")
+    if safe.isascii():
+        return f'attachment; filename="{safe}"'
+    fallback = "".join(c if c.isascii() else "_" for c in safe)
+    return f"attachment; filename=\"{fallback}\"; filename*=UTF-8''{quote(safe)}"
+
+
+async def register_download(data: bytes | bytearray, filename: str, media_type: str) -> str:
+    disposition = _content_disposition(filename)
+    token = secrets.token_urlsafe(16)
+    while not await DOWNLOADS.put(token, data, disposition, media_type, DOWNLOAD_TTL_SECS):
+        token = secrets.token_urlsafe(16)
+    return token
 
 
-def cleanup_downloads():
-    now = datetime.utcnow()
-    expired = [t for t, (_, _, _, exp) in DOWNLOADS.items() if exp <= now]
-    for t in expired:
-        DOWNLOADS.pop(t, None)
+# Ambos registros entregan la descarga como un iterador async de chunks más su
+# tamaño, así el endpoint arma siempre la misma respuesta.
+async def _iter_chunks(data: bytes | bytearray):
+    # Slices de memoryview: vistas sobre el payload, no copias. Generador async
+    # para que StreamingResponse no pase por el threadpool en cada chunk.
+    mv = memoryview(data)
+    # Archivos normales: un solo chunk con todo el payload
+    if len(mv) <= DOWNLOAD_STREAM_THRESHOLD:
+        yield mv
+        return
+    for i in range(0, len(mv), DOWNLOAD_CHUNK_SIZE):
+        yield mv[i:i + DOWNLOAD_CHUNK_SIZE]
 
 
-def register_download(data: bytes, filename: str, media_type: str) -> str:
-    cleanup_downloads()
-    token = secrets.token_urlsafe(16)
-    expires_at = datetime.utcnow() + timedelta(seconds=DOWNLOAD_TTL_SECS)
-    DOWNLOADS[token] = (data, filename, media_type, expires_at)
-    return token
+async def _iter_file(f):
+    # Lecturas por chunks en el threadpool (anyio), sin cargar el archivo
+    try:
+        while chunk := await f.read(DOWNLOAD_CHUNK_SIZE):
+            yield chunk
+    finally:
+        await f.aclose()
 
 # =========================
 # Formato de texto
 # =========================
-def format_run(run):
-    run.font.name = FONT
-    if run.font.size and run.font.size.pt >= TITLE_SIZE:
-        run.font.bold = True
-        run.font.color.rgb = TITLE_COLOR
-    else:
-        run.font.bold = False
-        run.font.color.rgb = NORMAL_COLOR
-
-
-def apply_rules(shape):
-    if hasattr(shape, "text_frame") and shape.text_frame:
-        for p in shape.text_frame.paragraphs:
-            for r in p.runs:
-                format_run(r)
-    if getattr(shape, "has_table", False):
-        for row in shape.table.rows:
-            for cell in row.cells:
-                for p in cell.text_frame.paragraphs:
-                    for r in p.runs:
-                        format_run(r)
-    if getattr(shape, "shape_type", None) == 6:
-        for s in shape.shapes:
-            apply_rules(s)
+# Recorrido directo sobre el XML: una sola consulta XPath por diapositiva o
+# layout trae todos los <a:r>, a cualquier profundidad de grupos y dentro de
+# celdas de tabla, sin recursión ni proxies de python-pptx por cada shape,
+# párrafo y run.
+A_NS = "http://schemas.openxmlformats.org/drawingml/2006/main"
+RUN_XPATH = etree.XPath(".//a:r", namespaces={"a": A_NS})
+
+
+def _format_run_elem(r_el, _font=FONT, _ts=TITLE_SIZE * 100,
+                     _tc=str(TITLE_COLOR), _nc=str(NORMAL_COLOR)):
+    # Se leen y escriben los atributos crudos (str) en lugar de los descriptores
+    # tipados de oxml, que parsean y validan el valor en cada acceso.
+    rPr = r_el.get_or_add_rPr()
+    latin = rPr.latin
+    if latin is None or latin.get("typeface") != _font:
+        rPr.get_or_add_latin().set("typeface", _font)
+    sz = rPr.get("sz")  # centésimas de punto
+    is_title = sz is not None and int(sz) >= _ts
+    bold = "1" if is_title else "0"
+    if rPr.get("b") != bold:
+        rPr.set("b", bold)
+    srgbClr = rPr.get_or_change_to_solidFill().get_or_change_to_srgbClr()
+    want_color = _tc if is_title else _nc
+    if srgbClr.get("val") != want_color:
+        srgbClr.set("val", want_color)
+
+
+def _format_runs(root):
+    for r_el in RUN_XPATH(root):
+        _format_run_elem(r_el)
 
 # =========================
 # Procesamiento principal
 # =========================
-def process_presentation(file_bytes: bytes, filename: str) -> bytes:
-    prs = Presentation(io.BytesIO(file_bytes))
+class _BytearrayIO(io.RawIOBase):
+    # Destino de prs.save() que escribe directo sobre un bytearray, evitando la
+    # copia extra de BytesIO.getvalue(). Es seekable porque zipfile reescribe
+    # las cabeceras locales al cerrar cada entrada.
+    def __init__(self):
+        self.buf = bytearray()
+        self.pos = 0
+
+    def writable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.pos
+        elif whence == io.SEEK_END:
+            offset += len(self.buf)
+        self.pos = offset
+        return offset
+
+    def write(self, b):
+        end = self.pos + len(b)
+        self.buf[self.pos:end] = b
+        self.pos = end
+        return len(b)
+
+
+def process_presentation(src, filename: str) -> bytearray:
+    # src: ruta o archivo binario; python-pptx lo lee directamente
+    prs = Presentation(src)
 
     if len(prs.slides) > 0:
         slide0 = prs.slides[0]
@@ -155,85 +473,201 @@ def process_presentation(file_bytes: bytes, filename: str) -> bytes:
 
             # Insertar logo justo debajo del texto visible
             logo_w_in = max(1.5, min((ref_w / EMU_PER_INCH) * 0.4, 5))
-            pic = slide0.shapes.add_picture(
-                DEFAULT_LOGO_PATH,
-                left=Inches(0), top=Inches(0), width=Inches(logo_w_in)
-            )
-            img_w = pic.width
-            img_h = pic.height
+            img_w = Inches(logo_w_in)
+            img_h = _logo_height(img_w)
 
             # Centrar horizontalmente con el texto y ubicar justo debajo
-            pic.left = ref_left + (ref_w - img_w) // 2
-            pic.top = ref_top + int(text_height * 1.1 * EMU_PER_INCH / 72)
+            slide0.shapes.add_picture(
+                _logo_stream(),
+                left=ref_left + (ref_w - img_w) // 2,
+                top=ref_top + int(text_height * 1.1 * EMU_PER_INCH / 72),
+                width=img_w, height=img_h,
+            )
 
     # Aplicar reglas a todas las diapositivas
-    for slide in prs.slides:
-        for shp in slide.shapes:
-            try:
-                apply_rules(shp)
-            except Exception:
-                pass
+    for idx, slide in enumerate(prs.slides, start=1):
+        try:
+            _format_runs(slide.element)
+        except Exception:
+            logger.warning("No se pudo formatear la diapositiva %d de %s", idx, filename, exc_info=True)
 
     # Aplicar a layouts
     for layout in prs.slide_layouts:
-        for shp in layout.shapes:
-            try:
-                apply_rules(shp)
-            except Exception:
-                pass
+        try:
+            _format_runs(layout.element)
+        except Exception:
+            logger.warning("No se pudo formatear el layout '%s' de %s", layout.name, filename, exc_info=True)
+
+    sink = _BytearrayIO()
+    prs.save(sink)
+    return sink.buf
 
-    out_bytes = io.BytesIO()
-    prs.save(out_bytes)
-    out_bytes.seek(0)
-    return out_bytes.getvalue()
+# =========================
+# Pool de procesos
+# =========================
+# El formateo es CPU puro (lxml + python-pptx): se ejecuta fuera del event loop
+# y en varios núcleos para no bloquear el resto de peticiones. Con
+# PPTX_WORKERS=0 no se crean procesos y el trabajo va al threadpool de
+# Starlette (instancias con poca RAM, donde cada proceso extra pesa).
+# Tope de trabajos en curso: acota RAM/CPU y evita que los uploads agoten el
+# threadpool que comparten los demás endpoints
+MAX_JOBS = int(os.getenv("MAX_JOBS", "4"))
+JOB_LIMITER = anyio.CapacityLimiter(MAX_JOBS)
+# Más workers que MAX_JOBS nunca recibirían trabajo y solo ocuparían RAM
+PPTX_WORKERS = int(os.getenv("PPTX_WORKERS", min(os.cpu_count() or 1, MAX_JOBS)))
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+# Navegadores sin Office instalado suelen mandar el pptx como binario o zip
+UPLOAD_CONTENT_TYPES = {
+    PPTX_MEDIA_TYPE,
+    "application/octet-stream",
+    "application/zip",
+    "application/x-zip-compressed",
+    "",
+    None,
+}
+
+
+def _copy_upload(fsrc, fdst):
+    # Copia por chunks: la subida nunca se materializa entera en memoria
+    shutil.copyfileobj(fsrc, fdst, UPLOAD_CHUNK_SIZE)
+    fdst.flush()
+
+
+def _warm_worker():
+    # Carga la plantilla por defecto de python-pptx y ejercita lxml/zipfile
+    Presentation()
+
+
+def _new_pool() -> ProcessPoolExecutor:
+    # Con fork (Linux) el primer submit lanza todos los workers; con spawn o
+    # forkserver se crean a demanda. Un warm-up por worker los levanta al
+    # arrancar en ambos casos, para que la primera ráfaga de subidas no pague
+    # el arranque ni la carga de la plantilla de python-pptx.
+    pool = ProcessPoolExecutor(max_workers=PPTX_WORKERS)
+    for _ in range(PPTX_WORKERS):
+        pool.submit(_warm_worker)
+    return pool
+
+
+def start_pool():
+    app.state.pool = _new_pool() if PPTX_WORKERS > 0 else None
+
+
+def _replace_pool(broken: ProcessPoolExecutor):
+    # Un worker muerto (p. ej. SIGKILL del OOM killer con un deck enorme) deja
+    # el pool inservible para siempre. Todos los trabajos en curso fallan a la
+    # vez: solo el primero lo reemplaza, el resto ya encuentra el nuevo.
+    if app.state.pool is broken:
+        logger.warning("Pool de procesos roto: se levanta uno nuevo")
+        app.state.pool = _new_pool()
+        broken.shutdown(wait=False)
+
+
+async def stop_pool():
+    if app.state.pool is not None:
+        app.state.pool.shutdown(wait=False)
+    await DOWNLOADS.close()
+
+
+async def run_job(upload: UploadFile):
+    await upload.seek(0)
+    if app.state.pool is None:
+        # Mismo proceso: python-pptx lee directo del archivo temporal de la subida
+        return await run_in_threadpool(process_presentation, upload.file, upload.filename)
+
+    # Otro proceso: la subida se vuelca a disco y el worker la abre por ruta,
+    # sin serializarla hacia el proceso. La copia es E/S bloqueante: va al
+    # threadpool en una sola llamada para no frenar el event loop.
+    with tempfile.NamedTemporaryFile(suffix=".pptx") as src:
+        await run_in_threadpool(_copy_upload, upload.file, src)
+        loop = asyncio.get_running_loop()
+        pool = app.state.pool
+        try:
+            job = loop.run_in_executor(pool, process_presentation, src.name, upload.filename)
+        except BrokenProcessPool:
+            # submit falla en el acto si el pool ya estaba roto: este trabajo
+            # nunca corrió, así que no es el culpable y va al pool nuevo
+            _replace_pool(pool)
+            pool = app.state.pool
+            job = loop.run_in_executor(pool, process_presentation, src.name, upload.filename)
+        try:
+            return await job
+        except BrokenProcessPool:
+            # Sin reintento: el trabajo estaba en el pool cuando cayó el worker y
+            # puede ser el deck que lo tiró; reintentarlo rompería el pool nuevo
+            _replace_pool(pool)
+            raise
 
 # =========================
 # Endpoints
 # =========================
 @app.post("/procesar/")
 async def procesar_pptx(request: Request, file: UploadFile = File(...)):
-    if not file.filename.lower().endswith(".pptx"):
+    # Solo se pasa a minúsculas la extensión. Para este punto FastAPI ya leyó
+    # el multipart completo (solo UploadLimitMiddleware actúa antes); el chequeo
+    # de content type evita procesar la subida y copiarla a un temporal.
+    root, ext = os.path.splitext(file.filename)
+    if ext.lower() != PPTX_EXT or file.content_type not in UPLOAD_CONTENT_TYPES:
         raise HTTPException(status_code=400, detail="El archivo debe ser un .pptx válido")
 
-    file_bytes = await file.read()
     try:
-        result_bytes = process_presentation(file_bytes, file.filename)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error procesando PPTX: {e}")
+        async with JOB_LIMITER:
+            result_bytes = await run_job(file)
+    except BrokenProcessPool:
+        raise HTTPException(
+            status_code=500,
+            detail="Error procesando PPTX: el proceso de formateo terminó inesperadamente",
+        )
+    # Abierto por ruta (pool) python-pptx responde PackageNotFoundError; desde
+    # el archivo de la subida (threadpool), BadZipFile. Mismo 400 en ambos casos.
+    except (PackageNotFoundError, BadZipFile):
+        raise HTTPException(status_code=400, detail="El archivo debe ser un .pptx válido")
+    except Exception:
+        # El texto de la excepción puede incluir rutas del servidor: solo al log
+        logger.exception("Error procesando %s", file.filename)
+        raise HTTPException(status_code=500, detail="Error procesando PPTX")
 
-    final_name = file.filename.replace(".pptx", "_FORMATEADO.pptx")
-    token = register_download(result_bytes, final_name, PPTX_MEDIA_TYPE)
+    final_name = f"{root}_FORMATEADO{PPTX_EXT}"
+    token = await register_download(result_bytes, final_name, PPTX_MEDIA_TYPE)
 
-    base_url = str(request.base_url).rstrip('/')
+    base_url = BASE_URL or str(request.base_url).rstrip('/')
     download_url = f"{base_url}/download/{token}"
-    return {"download_url": download_url, "expires_in_seconds": DOWNLOAD_TTL_SECS}
+    # Respuesta directa: evita el paso de jsonable_encoder sobre el dict
+    return ORJSONResponse({"download_url": download_url, "expires_in_seconds": DOWNLOAD_TTL_SECS})
 
 
 @app.get("/download/{token}")
-def download_token(token: str):
-    cleanup_downloads()
-    item = DOWNLOADS.get(token)
+async def download_token(token: str):
+    item = await DOWNLOADS.get(token)
     if not item:
         raise HTTPException(status_code=404, detail="Link expirado o inválido")
-    data, filename, media_type, exp = item
-    if exp <= datetime.utcnow():
-        DOWNLOADS.pop(token, None)
-        raise HTTPException(status_code=410, detail="Link expirado")
+    chunks, size, disposition, media_type = item
 
+    # El pptx ya es un zip: identity evita que un proxy o middleware gzip lo
+    # vuelva a comprimir sin ganar tamaño
     headers = {
-        "Content-Disposition": f'attachment; filename="{filename}"',
+        "Content-Disposition": disposition,
         "Cache-Control": "no-store",
+        "Content-Encoding": "identity",
+        "Content-Length": str(size),
     }
-    return StreamingResponse(io.BytesIO(data), media_type=media_type, headers=headers)
+    return StreamingResponse(chunks, media_type=media_type, headers=headers)
+
+
+# Cuerpos fijos serializados una sola vez al importar. Se crea un Response nuevo
+# por petición (no una instancia compartida) porque los middlewares, p. ej. CORS,
+# modifican la lista de cabeceras de la respuesta en sitio.
+ROOT_BODY = orjson.dumps({"message": "API de Formateo de PPTX funcionando", "version": "1.0.1"})
+HEALTH_BODY = orjson.dumps({"status": "healthy", "message": "API funcionando correctamente"})
 
 
 @app.get("/")
 async def root():
-    return {"message": "API de Formateo de PPTX funcionando", "version": "1.0.1"}
+    return Response(ROOT_BODY, media_type="application/json")
 
 
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy", "message": "API funcionando correctamente"}
+    return Response(HEALTH_BODY, media_type="application/json")
 
 